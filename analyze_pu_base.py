@@ -5,8 +5,10 @@ Script d'analyse des prix de la table PU_BASE de la CCAM v79.10
 Analyse les tarifs de base des actes CCAM selon différentes grilles tarifaires.
 """
 
+import argparse
+import sys
 from pathlib import Path
-import pandas as pd
+import numpy as np
 from extract_and_convert import convert_dbf_to_df
 
 
@@ -38,27 +40,44 @@ class PUBaseAnalyzer:
 
     def print_statistics(self):
         """Affiche les statistiques globales"""
-        print("\n" + "=" * 80)
-        print("STATISTIQUES GLOBALES")
-        print("=" * 80)
-
-        print(f"\nNombre total d'enregistrements: {len(self.df):,}")
-        print(f"Nombre d'actes uniques: {self.df['aap_cod'].nunique():,}")
-        print(f"Nombre de grilles tarifaires: {self.df['grille_cod'].nunique()}")
-
-        print("\n--- Prix (PU_BASE) ---")
-        print(f"Prix moyen: {self.df['pu_base'].mean():.2f} €")
-        print(f"Prix médian: {self.df['pu_base'].median():.2f} €")
-        print(f"Prix min: {self.df['pu_base'].min():.2f} €")
-        print(f"Prix max: {self.df['pu_base'].max():.2f} €")
-        print(f"Écart-type: {self.df['pu_base'].std():.2f} €")
+        # Calculs directement sur le tableau NumPy, NaN écartés comme avec pandas
+        prix = self.df['pu_base'].to_numpy(dtype=np.float64)
+        prix = prix[~np.isnan(prix)]
 
-        # Distribution des prix
-        print("\n--- Distribution des prix ---")
+        # Distribution des prix : tous les percentiles en un seul appel
         percentiles = [10, 25, 50, 75, 90, 95, 99]
-        for p in percentiles:
-            value = self.df['pu_base'].quantile(p / 100)
-            print(f"Percentile {p:2d}%: {value:8.2f} €")
+
+        # Colonne vide : NaN affiché, comme les réductions pandas
+        if prix.size:
+            moyenne, mediane, minimum, maximum = prix.mean(), np.median(prix), prix.min(), prix.max()
+            values = np.quantile(prix, [p / 100 for p in percentiles])
+        else:
+            moyenne = mediane = minimum = maximum = np.nan
+            values = np.full(len(percentiles), np.nan)
+        ecart_type = prix.std(ddof=1) if prix.size > 1 else np.nan
+
+        # Lignes accumulées puis écrites en une seule fois
+        lines = [
+            "",
+            "=" * 80,
+            "STATISTIQUES GLOBALES",
+            "=" * 80,
+            "",
+            f"Nombre total d'enregistrements: {len(self.df):,}",
+            f"Nombre d'actes uniques: {self.df['aap_cod'].nunique():,}",
+            f"Nombre de grilles tarifaires: {self.df['grille_cod'].nunique()}",
+            "",
+            "--- Prix (PU_BASE) ---",
+            f"Prix moyen: {moyenne:.2f} €",
+            f"Prix médian: {mediane:.2f} €",
+            f"Prix min: {minimum:.2f} €",
+            f"Prix max: {maximum:.2f} €",
+            f"Écart-type: {ecart_type:.2f} €",
+            "",
+            "--- Distribution des prix ---",
+        ]
+        lines.extend(f"Percentile {p:2d}%: {value:8.2f} €" for p, value in zip(percentiles, values))
+        sys.stdout.write("\n".join(lines) + "\n")
 
     def analyze_by_grille(self):
         """Analyse les prix par grille tarifaire"""
@@ -155,10 +174,6 @@ class PUBaseAnalyzer:
         print("ANALYSE TEMPORELLE")
         print("=" * 80)
 
-        # Convertir en datetime si ce n'est pas déjà fait
-        if not pd.api.types.is_datetime64_any_dtype(self.df['apdt_modif']):
-            self.df['apdt_modif'] = pd.to_datetime(self.df['apdt_modif'])
-
         print(f"\nDate de modification la plus ancienne: {self.df['apdt_modif'].min()}")
         print(f"Date de modification la plus récente: {self.df['apdt_modif'].max()}")
 
@@ -180,14 +195,29 @@ class PUBaseAnalyzer:
 
         return modifs_par_an
 
-    def export_full_data(self):
-        """Exporte toutes les données en CSV"""
-        output_file = self.output_dir / "pu_base_complete.csv"
-        self.df.to_csv(output_file, index=False)
+    def export_full_data(self, export_format='parquet'):
+        """
+        Exporte toutes les données
+
+        Args:
+            export_format: 'parquet' (compressé, par défaut) ou 'csv'
+        """
+        if export_format == 'csv':
+            # Même fichier que l'export historique (compatibilité des consommateurs)
+            output_file = self.output_dir / "pu_base_complete.csv"
+            self.df.to_csv(output_file, index=False)
+        else:
+            output_file = self.output_dir / "pu_base_complete.parquet"
+            self.df.to_parquet(output_file, engine='pyarrow', compression='snappy', index=False)
         print(f"\n✓ Données complètes exportées: {output_file}")
 
-    def run_full_analysis(self):
-        """Exécute l'analyse complète"""
+    def run_full_analysis(self, export_format='parquet'):
+        """
+        Exécute l'analyse complète
+
+        Args:
+            export_format: Format de l'export complet ('parquet' ou 'csv')
+        """
         print("=" * 80)
         print("ANALYSE DES PRIX CCAM - TABLE PU_BASE")
         print("=" * 80)
@@ -201,7 +231,7 @@ class PUBaseAnalyzer:
         self.top_actes_by_price(n=20)
         self.analyze_by_acte()
         self.analyze_temporal()
-        self.export_full_data()
+        self.export_full_data(export_format)
 
         print("\n" + "=" * 80)
         print(f"✓ ANALYSE TERMINÉE - Résultats exportés dans: {self.output_dir}")
@@ -210,11 +240,16 @@ class PUBaseAnalyzer:
 
 def main():
     """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Analyse des prix de la table PU_BASE")
+    parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet',
+                        help="Format de l'export des données complètes (défaut : parquet)")
+    args = parser.parse_args()
+
     project_root = Path(__file__).parent
     data_path = project_root / "data" / "ccam_v79.10"
 
     analyzer = PUBaseAnalyzer(data_path)
-    analyzer.run_full_analysis()
+    analyzer.run_full_analysis(export_format=args.format)
 
 
 if __name__ == "__main__":
@@ -8,12 +8,121 @@ Ce script :
 3. Génère un fichier Excel par menu avec l'évolution des prix de 2005 à 2025
 """
 
+import functools
+import hashlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+import numpy as np
 import pandas as pd
-from extract_and_convert import convert_dbf_to_df
+import pyarrow as pa
+import pyarrow.compute as pc
+from convert_dbf_to_pickle import convert_and_save
+from extract_and_convert import CACHE_VERSION, PICKLE_DIR, convert_dbf_to_df, is_pickle_fresh
 from datetime import datetime
 
 
+# Version du cache de la table jointe : à incrémenter à chaque changement
+# de merge_tables / apply_filters pour invalider les anciens Parquet
+MERGED_CACHE_VERSION = 1
+
+# Tables chargées : attribut ➜ (table, colonnes utiles, libellé du compte)
+TABLES = {
+    'df_acte': ("R_ACTE", ['cod_acte', 'nom_court', 'nom_long', 'menu_cod'], "actes chargés"),
+    'df_acte_ivite': ("R_ACTE_IVITE", ['acte_cod', 'cod_aa', 'activ_cod'], "actes-activités chargés"),
+    'df_acte_ivite_phase': ("R_ACTE_IVITE_PHASE", ['aa_cod', 'cod_aap', 'phase_cod'],
+                            "actes-activités-phases chargés"),
+    'df_pu_base': ("R_PU_BASE", ['aap_cod', 'grille_cod', 'pu_base', 'apdt_modif'], "prix de base chargés"),
+    'df_menu': ("R_MENU", ['cod_menu', 'libelle', 'cod_pere'], "menus chargés"),
+    'df_activite': ("R_ACTIVITE", ['cod_activ', 'libelle'], "activités chargées"),
+    'df_grille': ("R_TB23", ['cod_grille', 'libelle'], "grilles chargées"),
+}
+
+# Clés de jointure numériques (codes courts) et libellés répétés
+CODE_COLUMNS = ('grille_cod', 'activ_cod', 'phase_cod', 'menu_cod',
+                'cod_menu', 'cod_pere', 'cod_grille', 'cod_activ')
+LABEL_COLUMNS = ('libelle', 'nom_court', 'nom_long')
+
+# Caractères remplacés par '_' dans les noms de fichiers (\w : alphanumérique ou '_')
+UNSAFE_FILENAME_CHARS = re.compile(r'[^\w \-]')
+
+
+def optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Réduit les codes au plus petit type entier et passe les libellés en category"""
+    for col in CODE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    for col in LABEL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+
+def to_arrow(df: pd.DataFrame, rang_column: str = None) -> pa.Table:
+    """Convertit un DataFrame en table Arrow, avec éventuellement une colonne de numéro de ligne"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if rang_column is not None:
+        table = table.append_column(rang_column, pa.array(np.arange(len(table), dtype=np.int64)))
+    return table
+
+
+def arrow_join(left: pa.Table, right: pa.Table, left_key: str, right_key: str, join_type: str) -> pa.Table:
+    """
+    Jointure Arrow (hash join C++ multi-thread) sans dupliquer la clé de droite
+
+    Arrow exige des clés de même type : les codes entiers de largeurs
+    différentes sont convertis vers le type le plus large.
+    """
+    left_type = left.schema.field(left_key).type
+    right_type = right.schema.field(right_key).type
+    if left_type != right_type:
+        if pa.types.is_integer(left_type) and pa.types.is_integer(right_type):
+            if pa.types.is_signed_integer(left_type) == pa.types.is_signed_integer(right_type):
+                key_type = max(left_type, right_type, key=lambda t: t.bit_width)
+            else:
+                key_type = pa.int64()
+        elif pa.types.is_integer(left_type) or pa.types.is_floating(left_type):
+            key_type = pa.float64()
+        else:
+            key_type = left_type
+        left = left.set_column(left.schema.get_field_index(left_key), left_key, left[left_key].cast(key_type))
+        right = right.set_column(right.schema.get_field_index(right_key), right_key, right[right_key].cast(key_type))
+
+    return left.join(right, keys=left_key, right_keys=right_key, join_type=join_type,
+                     left_suffix='_x', right_suffix='_y', coalesce_keys=True)
+
+
+def write_menu_excel(filename: Path, df_analysis: pd.DataFrame) -> Path:
+    """
+    Écrit le fichier Excel d'un menu
+
+    Fonction de module pour pouvoir être exécutée dans un processus séparé.
+    """
+    # Créer le fichier Excel avec plusieurs feuilles (xlsxwriter : écriture seule,
+    # sans constant_memory car pandas écrit les cellules colonne par colonne)
+    with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
+        # Feuille principale : évolution des prix
+        df_analysis.to_excel(writer, sheet_name='Evolution_prix', index=False)
+
+        # Feuille 2 : Statistiques par grille
+        stats_by_grille = df_analysis.groupby(['grille_cod', 'grille_libelle'], observed=True).agg({
+            'cod_acte': 'count',
+            'prix_initial': 'mean',
+            'prix_actuel': 'mean',
+            'evolution_euros': 'mean',
+            'evolution_pct': 'mean'
+        }).round(2)
+        stats_by_grille.columns = ['Nb_actes', 'Prix_initial_moyen', 'Prix_actuel_moyen', 'Evolution_€_moyenne', 'Evolution_%_moyenne']
+        stats_by_grille.to_excel(writer, sheet_name='Stats_par_grille')
+
+        # Feuille 3 : Top évolutions
+        top_evolutions = df_analysis.nlargest(20, 'evolution_euros')[['cod_acte', 'nom_court', 'grille_cod', 'prix_initial', 'prix_actuel', 'evolution_euros', 'evolution_pct']]
+        top_evolutions.to_excel(writer, sheet_name='Top_evolutions', index=False)
+
+    return filename
+
+
 class CCAMPriceEvolutionAnalyzer:
     """Analyseur d'évolution des prix CCAM"""
 
@@ -27,6 +136,7 @@ class CCAMPriceEvolutionAnalyzer:
         self.data_path = data_path
         self.output_dir = Path(__file__).parent / "output_by_menu"
         self.output_dir.mkdir(exist_ok=True)
+        self.cache_dir = Path(__file__).parent / "data" / "cache"
 
         # Critères de filtrage
         self.grilles_filter = [3, 4, 5, 7, 17, 18]
@@ -43,157 +153,220 @@ class CCAMPriceEvolutionAnalyzer:
         self.df_grille = None
         self.df_merged = None
 
+        # Tables de correspondance (construites au chargement)
+        self.grille_names = None
+        self.menu_by_cod = None
+        self.menu_path = None
+
     def load_all_tables(self):
         """Charge toutes les tables nécessaires"""
         print("\n" + "=" * 80)
         print("CHARGEMENT DES TABLES")
         print("=" * 80)
 
-        print("\n📊 Chargement de R_ACTE...")
-        self.df_acte = convert_dbf_to_df(self.data_path / "R_ACTE.dbf")
-        print(f"   ✓ {len(self.df_acte):,} actes chargés")
-
-        print("\n📊 Chargement de R_ACTE_IVITE...")
-        self.df_acte_ivite = convert_dbf_to_df(self.data_path / "R_ACTE_IVITE.dbf")
-        print(f"   ✓ {len(self.df_acte_ivite):,} actes-activités chargés")
-
-        print("\n📊 Chargement de R_ACTE_IVITE_PHASE...")
-        self.df_acte_ivite_phase = convert_dbf_to_df(self.data_path / "R_ACTE_IVITE_PHASE.dbf")
-        print(f"   ✓ {len(self.df_acte_ivite_phase):,} actes-activités-phases chargés")
-
-        print("\n📊 Chargement de R_PU_BASE...")
-        self.df_pu_base = convert_dbf_to_df(self.data_path / "R_PU_BASE.dbf")
-        print(f"   ✓ {len(self.df_pu_base):,} prix de base chargés")
-
-        print("\n📊 Chargement de R_MENU...")
-        self.df_menu = convert_dbf_to_df(self.data_path / "R_MENU.dbf")
-        print(f"   ✓ {len(self.df_menu):,} menus chargés")
-
-        print("\n📊 Chargement de R_ACTIVITE...")
-        self.df_activite = convert_dbf_to_df(self.data_path / "R_ACTIVITE.dbf")
-        print(f"   ✓ {len(self.df_activite):,} activités chargées")
-
-        print("\n📊 Chargement de R_TB23 (grilles)...")
-        self.df_grille = convert_dbf_to_df(self.data_path / "R_TB23.dbf")
-        print(f"   ✓ {len(self.df_grille):,} grilles chargées")
+        # Tables sans pickle à jour (date ou version) : le décodage des chaînes
+        # garde le GIL, elles sont donc converties en parallèle dans des
+        # processus qui écrivent le cache
+        cold = [self.data_path / f"{table_name}.dbf" for table_name, _, _ in TABLES.values()
+                if not is_pickle_fresh(self.data_path / f"{table_name}.dbf", PICKLE_DIR / f"{table_name}.pkl")]
+        if cold:
+            print(f"\n🔄 Conversion des tables sans cache: {len(cold)}")
+            with ProcessPoolExecutor(max_workers=max(1, min(len(cold), os.cpu_count() or 1))) as executor:
+                for result in executor.map(convert_and_save, cold, [PICKLE_DIR] * len(cold)):
+                    print(result)
+
+        # Relecture des pickles, surtout des E/S : en parallèle par des threads
+        with ThreadPoolExecutor(max_workers=len(TABLES)) as executor:
+            futures = {
+                attr: executor.submit(self.load_table, table_name, columns)
+                for attr, (table_name, columns, _) in TABLES.items()
+            }
+            for attr, (table_name, _, description) in TABLES.items():
+                setattr(self, attr, futures[attr].result())
+                print(f"\n📊 {table_name}")
+                print(f"   ✓ {len(getattr(self, attr)):,} {description}")
+
+        self.build_lookups()
+
+    def load_table(self, table_name, columns):
+        """Charge une table DBF en ne gardant que les colonnes utiles"""
+        return optimize_dtypes(convert_dbf_to_df(self.data_path / f"{table_name}.dbf", columns=columns))
+
+    def build_lookups(self):
+        """Construit les tables de correspondance code ➜ libellé"""
+        self.grille_names = dict(zip(self.df_grille['cod_grille'], self.df_grille['libelle']))
+        self.menu_by_cod = self.df_menu.drop_duplicates('cod_menu').set_index('cod_menu')
+
+        # Chemin hiérarchique mémoïsé : chaque ancêtre n'est parcouru qu'une fois,
+        # le cache est recréé à chaque chargement
+        menu_info = dict(zip(self.menu_by_cod.index,
+                             zip(self.menu_by_cod['libelle'], self.menu_by_cod['cod_pere'])))
+
+        @functools.lru_cache(maxsize=None)
+        def menu_path(menu_cod):
+            if menu_cod == 0 or menu_cod is None or menu_cod not in menu_info:
+                return ()
+            libelle, cod_pere = menu_info[menu_cod]
+            return menu_path(cod_pere) + (f"{menu_cod}_{libelle}",)
+
+        self.menu_path = menu_path
 
     def merge_tables(self):
-        """Joint toutes les tables"""
+        """
+        Joint toutes les tables
+
+        Filtres et jointures sont exécutés sur des tables Arrow (noyaux C++
+        multi-thread) ; la conversion en pandas n'a lieu qu'une fois à la fin.
+        """
         print("\n" + "=" * 80)
         print("JOINTURE DES TABLES")
         print("=" * 80)
 
+        # Numéros de ligne d'origine : les jointures Arrow ne garantissent pas
+        # l'ordre des lignes, il est rétabli par un tri final
+        acte_ivite = to_arrow(self.df_acte_ivite, 'rang_acte_ivite')
+        acte_ivite_phase = to_arrow(self.df_acte_ivite_phase, 'rang_acte_ivite_phase')
+        pu_base = to_arrow(self.df_pu_base, 'rang_pu_base')
+
+        # Les filtres sont appliqués sur les tables de base avant les jointures :
+        # seules les lignes retenues traversent la chaîne de jointures
+        print("\n🔍 Filtrage des tables avant jointure...")
+        n_acte_ivite, n_acte_ivite_phase, n_pu_base = len(acte_ivite), len(acte_ivite_phase), len(pu_base)
+        acte_ivite = acte_ivite.filter(
+            pc.is_in(acte_ivite['activ_cod'], value_set=pa.array(self.activites_filter)))
+        acte_ivite_phase = acte_ivite_phase.filter(
+            pc.equal(acte_ivite_phase['phase_cod'], self.phase_filter))
+        pu_base = pu_base.filter(
+            pc.is_in(pu_base['grille_cod'], value_set=pa.array(self.grilles_filter)))
+        print(f"   ✓ R_ACTE_IVITE : {len(acte_ivite):,} / {n_acte_ivite:,} lignes (activités {self.activites_filter})")
+        print(f"   ✓ R_ACTE_IVITE_PHASE : {len(acte_ivite_phase):,} / {n_acte_ivite_phase:,} lignes (phase {self.phase_filter})")
+        print(f"   ✓ R_PU_BASE : {len(pu_base):,} / {n_pu_base:,} lignes (grilles {self.grilles_filter})")
+
         # 1. R_ACTE + R_ACTE_IVITE (acte_cod -> cod_acte)
         print("\n1️⃣  Jointure R_ACTE + R_ACTE_IVITE...")
-        df_temp = pd.merge(
-            self.df_acte_ivite,
-            self.df_acte,
-            left_on='acte_cod',
-            right_on='cod_acte',
-            how='inner'
-        )
-        print(f"   ✓ {len(df_temp):,} lignes après jointure")
+        table = arrow_join(acte_ivite, to_arrow(self.df_acte, 'rang_acte'), 'acte_cod', 'cod_acte', 'inner')
+        table = table.append_column('cod_acte', table['acte_cod'])
+        print(f"   ✓ {len(table):,} lignes après jointure")
 
         # 2. + R_ACTE_IVITE_PHASE (cod_aa -> aa_cod)
         print("\n2️⃣  Jointure + R_ACTE_IVITE_PHASE...")
-        df_temp = pd.merge(
-            df_temp,
-            self.df_acte_ivite_phase,
-            left_on='cod_aa',
-            right_on='aa_cod',
-            how='inner'
-        )
-        print(f"   ✓ {len(df_temp):,} lignes après jointure")
+        table = arrow_join(table, acte_ivite_phase, 'cod_aa', 'aa_cod', 'inner')
+        print(f"   ✓ {len(table):,} lignes après jointure")
 
         # 3. + R_PU_BASE (cod_aap -> aap_cod + grille_cod)
         print("\n3️⃣  Jointure + R_PU_BASE...")
-        df_temp = pd.merge(
-            df_temp,
-            self.df_pu_base,
-            left_on='cod_aap',
-            right_on='aap_cod',
-            how='inner'
-        )
-        print(f"   ✓ {len(df_temp):,} lignes après jointure")
+        table = arrow_join(table, pu_base, 'cod_aap', 'aap_cod', 'inner')
+        print(f"   ✓ {len(table):,} lignes après jointure")
 
         # 4. + R_MENU (menu_cod -> cod_menu)
         print("\n4️⃣  Jointure + R_MENU...")
-        df_temp = pd.merge(
-            df_temp,
-            self.df_menu[['cod_menu', 'libelle', 'cod_pere']],
-            left_on='menu_cod',
-            right_on='cod_menu',
-            how='left'
-        )
-        df_temp = df_temp.rename(columns={'libelle': 'menu_libelle'})
-        print(f"   ✓ {len(df_temp):,} lignes après jointure")
+        df_menu = self.df_menu[['cod_menu', 'libelle', 'cod_pere']].rename(columns={'libelle': 'menu_libelle'})
+        table = arrow_join(table, to_arrow(df_menu), 'menu_cod', 'cod_menu', 'left outer')
+        print(f"   ✓ {len(table):,} lignes après jointure")
 
         # 5. + R_ACTIVITE (activ_cod -> cod_activ)
         print("\n5️⃣  Jointure + R_ACTIVITE...")
-        df_temp = pd.merge(
-            df_temp,
-            self.df_activite,
-            left_on='activ_cod',
-            right_on='cod_activ',
-            how='left'
-        )
-        df_temp = df_temp.rename(columns={'libelle': 'activite_libelle'})
-        print(f"   ✓ {len(df_temp):,} lignes après jointure")
+        df_activite = self.df_activite.rename(columns={'libelle': 'activite_libelle'})
+        table = arrow_join(table, to_arrow(df_activite), 'activ_cod', 'cod_activ', 'left outer')
+        print(f"   ✓ {len(table):,} lignes après jointure")
 
         # 6. + R_TB23 (grille_cod -> cod_grille)
         print("\n6️⃣  Jointure + R_TB23 (grilles)...")
-        df_temp = pd.merge(
-            df_temp,
-            self.df_grille[['cod_grille', 'libelle']],
-            left_on='grille_cod',
-            right_on='cod_grille',
-            how='left'
-        )
-        df_temp = df_temp.rename(columns={'libelle': 'grille_libelle'})
-        print(f"   ✓ {len(df_temp):,} lignes après jointure")
+        df_grille = self.df_grille[['cod_grille', 'libelle']].rename(columns={'libelle': 'grille_libelle'})
+        table = arrow_join(table, to_arrow(df_grille), 'grille_cod', 'cod_grille', 'left outer')
+        print(f"   ✓ {len(table):,} lignes après jointure")
+
+        # Ordre des lignes identique à une suite de jointures pandas
+        rang_columns = ['rang_acte_ivite', 'rang_acte', 'rang_acte_ivite_phase', 'rang_pu_base']
+        table = table.sort_by([(col, 'ascending') for col in rang_columns]).drop_columns(rang_columns)
 
-        self.df_merged = df_temp
+        self.df_merged = table.to_pandas()
         print(f"\n✅ Jointure complète : {len(self.df_merged):,} lignes")
 
     def apply_filters(self):
-        """Applique les filtres selon les critères"""
+        """
+        Vérifie les filtres selon les critères
+
+        Les filtres sont déjà appliqués avant jointure dans `merge_tables` ;
+        cette étape affiche les comptes et ne copie la table que si des
+        lignes hors critères subsistent.
+        """
         print("\n" + "=" * 80)
         print("APPLICATION DES FILTRES")
         print("=" * 80)
 
         print(f"\nAvant filtrage : {len(self.df_merged):,} lignes")
 
+        # Un seul masque booléen cumulé
+        df = self.df_merged
+
         # Filtre sur les grilles
         print(f"\n🔍 Filtre grilles : {self.grilles_filter}")
-        self.df_merged = self.df_merged[self.df_merged['grille_cod'].isin(self.grilles_filter)]
-        print(f"   ✓ {len(self.df_merged):,} lignes restantes")
+        mask = np.isin(df['grille_cod'].to_numpy(), np.asarray(self.grilles_filter))
+        print(f"   ✓ {mask.sum():,} lignes restantes")
 
         # Filtre sur les activités
         print(f"\n🔍 Filtre activités : {self.activites_filter}")
-        self.df_merged = self.df_merged[self.df_merged['activ_cod'].isin(self.activites_filter)]
-        print(f"   ✓ {len(self.df_merged):,} lignes restantes")
+        mask &= np.isin(df['activ_cod'].to_numpy(), np.asarray(self.activites_filter))
+        print(f"   ✓ {mask.sum():,} lignes restantes")
 
         # Filtre sur la phase
         print(f"\n🔍 Filtre phase : {self.phase_filter}")
-        self.df_merged = self.df_merged[self.df_merged['phase_cod'] == self.phase_filter]
-        print(f"   ✓ {len(self.df_merged):,} lignes restantes")
+        mask &= df['phase_cod'].to_numpy() == self.phase_filter
+        print(f"   ✓ {mask.sum():,} lignes restantes")
+
+        if not mask.all():
+            self.df_merged = df.loc[mask].copy()
 
         print(f"\n✅ Après filtrage : {len(self.df_merged):,} lignes")
 
+    def get_merged_cache_path(self):
+        """
+        Chemin du cache Parquet de la table jointe et filtrée
+
+        Le nom dépend des DBF sources (nom, taille, date de modification), des
+        versions du lecteur DBF et de la jointure, des colonnes chargées et
+        des critères de filtrage : toute modification invalide le cache.
+        """
+        signature = (
+            CACHE_VERSION,
+            MERGED_CACHE_VERSION,
+            tuple(sorted((p.name, p.stat().st_size, p.stat().st_mtime_ns)
+                         for p in self.data_path.glob("R_*.dbf"))),
+            tuple((table_name, tuple(columns)) for table_name, columns, _ in TABLES.values()),
+            tuple(self.grilles_filter),
+            tuple(self.activites_filter),
+            self.phase_filter,
+        )
+        digest = hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+        return self.cache_dir / f"merged_{digest}.parquet"
+
+    def load_or_build_merged(self):
+        """Relit la table jointe et filtrée depuis le cache, ou la construit et la met en cache"""
+        cache_file = self.get_merged_cache_path()
+
+        if cache_file.exists():
+            self.df_merged = pd.read_parquet(cache_file)
+            print(f"\n♻️  Table jointe relue depuis le cache : {len(self.df_merged):,} lignes ({cache_file.name})")
+            return
+
+        self.merge_tables()
+        self.apply_filters()
+
+        # Écriture atomique ; les colonnes category sont stockées en dictionnaire par pyarrow
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix('.parquet.tmp')
+        self.df_merged.to_parquet(tmp_file, engine='pyarrow', index=False)
+        os.replace(tmp_file, cache_file)
+
+        # Les caches des signatures précédentes ne seront plus relus
+        for old_file in self.cache_dir.glob("merged_*.parquet"):
+            if old_file != cache_file:
+                old_file.unlink(missing_ok=True)
+
     def get_menu_hierarchy_path(self, menu_cod):
         """Récupère le chemin hiérarchique d'un menu"""
-        path = []
-        current = menu_cod
-
-        while current != 0 and current is not None:
-            menu_row = self.df_menu[self.df_menu['cod_menu'] == current]
-            if not menu_row.empty:
-                libelle = menu_row.iloc[0]['libelle']
-                path.insert(0, f"{current}_{libelle}")
-                current = menu_row.iloc[0]['cod_pere']
-            else:
-                break
-
+        path = self.menu_path(menu_cod)
         return " > ".join(path) if path else "SANS_MENU"
 
     def group_by_menu(self):
@@ -207,98 +380,83 @@ class CCAMPriceEvolutionAnalyzer:
 
         return menus
 
-    def analyze_price_evolution_for_menu(self, menu_cod):
-        """Analyse l'évolution des prix pour un menu donné"""
-        # Filtrer par menu
-        df_menu = self.df_merged[self.df_merged['menu_cod'] == menu_cod].copy()
-
-        if df_menu.empty:
-            return None
-
-        # Convertir les dates
-        if not pd.api.types.is_datetime64_any_dtype(df_menu['apdt_modif']):
-            df_menu['apdt_modif'] = pd.to_datetime(df_menu['apdt_modif'], errors='coerce')
-
-        # Pour chaque acte, on veut l'évolution du prix dans le temps
-        results = []
-
-        actes = df_menu['cod_acte'].unique()
-        for acte in actes:
-            df_acte = df_menu[df_menu['cod_acte'] == acte]
-
-            # Informations de l'acte
-            acte_info = df_acte.iloc[0]
-
-            # Pour chaque grille
-            for grille in self.grilles_filter:
-                df_acte_grille = df_acte[df_acte['grille_cod'] == grille]
-
-                if not df_acte_grille.empty:
-                    # Trier par date
-                    df_acte_grille = df_acte_grille.sort_values('apdt_modif')
-
-                    # Première et dernière modification
-                    first = df_acte_grille.iloc[0]
-                    last = df_acte_grille.iloc[-1]
-
-                    result = {
-                        'cod_acte': acte,
-                        'nom_court': acte_info['nom_court'],
-                        'nom_long': acte_info['nom_long'],
-                        'activite': acte_info['activ_cod'],
-                        'activite_libelle': acte_info['activite_libelle'],
-                        'grille_cod': grille,
-                        'grille_libelle': acte_info['grille_libelle'] if grille == acte_info['grille_cod'] else self.df_grille[self.df_grille['cod_grille'] == grille].iloc[0]['libelle'],
-                        'date_premiere_modif': first['apdt_modif'],
-                        'prix_initial': first['pu_base'],
-                        'date_derniere_modif': last['apdt_modif'],
-                        'prix_actuel': last['pu_base'],
-                        'evolution_euros': last['pu_base'] - first['pu_base'],
-                        'evolution_pct': ((last['pu_base'] - first['pu_base']) / first['pu_base'] * 100) if first['pu_base'] != 0 else 0,
-                        'nb_modifications': len(df_acte_grille)
-                    }
-                    results.append(result)
-
-        return pd.DataFrame(results)
-
-    def export_menu_to_excel(self, menu_cod, df_analysis):
-        """Exporte l'analyse d'un menu en Excel"""
-        if df_analysis is None or df_analysis.empty:
-            return
+    def analyze_price_evolution(self):
+        """
+        Analyse l'évolution des prix de tous les menus en une seule passe
 
+        Pour chaque (menu, acte, grille) : première et dernière modification
+        du prix (par date) et nombre de modifications.
+        """
+        keys = ['menu_cod', 'cod_acte', 'grille_cod']
+
+        df = self.df_merged
+        if df.empty:
+            return pd.DataFrame()
+
+        # Informations de l'acte : première ligne de l'acte dans le menu
+        acte_info = (
+            df.drop_duplicates(['menu_cod', 'cod_acte'])
+            .set_index(['menu_cod', 'cod_acte'])
+            [['nom_court', 'nom_long', 'activ_cod', 'activite_libelle']]
+            .rename(columns={'activ_cod': 'activite'})
+        )
+        acte_info['rang_acte'] = range(len(acte_info))
+
+        # Trier une seule fois par date (tri stable), puis première et dernière modification par groupe
+        df = df.sort_values('apdt_modif', kind='mergesort')
+        first = df.drop_duplicates(keys, keep='first').set_index(keys)
+        last = df.drop_duplicates(keys, keep='last').set_index(keys).reindex(first.index)
+
+        results = pd.DataFrame({
+            'date_premiere_modif': first['apdt_modif'],
+            'prix_initial': first['pu_base'],
+            'date_derniere_modif': last['apdt_modif'],
+            'prix_actuel': last['pu_base'],
+            'nb_modifications': df.groupby(keys, observed=True).size().reindex(first.index),
+        })
+        results['evolution_euros'] = results['prix_actuel'] - results['prix_initial']
+        prix_initial = results['prix_initial'].to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            results['evolution_pct'] = np.where(
+                prix_initial != 0,
+                results['evolution_euros'].to_numpy() / prix_initial * 100,
+                0
+            )
+
+        results = results.reset_index().join(acte_info, on=['menu_cod', 'cod_acte'])
+        results['grille_libelle'] = results['grille_cod'].map(self.grille_names)
+
+        # Ordre d'origine : actes par ordre d'apparition, grilles dans l'ordre du filtre
+        grille_rang = {grille: rang for rang, grille in enumerate(self.grilles_filter)}
+        results['rang_grille'] = results['grille_cod'].map(grille_rang)
+        results = results.sort_values(['rang_acte', 'rang_grille'], kind='mergesort')
+
+        return results[[
+            'menu_cod', 'cod_acte', 'nom_court', 'nom_long', 'activite', 'activite_libelle',
+            'grille_cod', 'grille_libelle', 'date_premiere_modif', 'prix_initial',
+            'date_derniere_modif', 'prix_actuel', 'evolution_euros', 'evolution_pct',
+            'nb_modifications'
+        ]].reset_index(drop=True)
+
+    def get_menu_filename(self, menu_cod):
+        """Construit le nom du fichier Excel d'un menu"""
         # Récupérer le nom du menu
-        menu_info = self.df_menu[self.df_menu['cod_menu'] == menu_cod]
-        if menu_info.empty:
+        if menu_cod not in self.menu_by_cod.index:
             menu_name = f"Menu_{menu_cod}"
         else:
-            menu_name = menu_info.iloc[0]['libelle']
+            menu_name = self.menu_by_cod.at[menu_cod, 'libelle']
             # Nettoyer le nom pour le système de fichiers
-            menu_name = "".join(c if c.isalnum() or c in (' ', '-', '_') else '_' for c in menu_name)
+            menu_name = UNSAFE_FILENAME_CHARS.sub('_', menu_name)
             menu_name = menu_name[:100]  # Limiter la longueur
 
-        filename = self.output_dir / f"{menu_cod}_{menu_name}.xlsx"
-
-        # Créer le fichier Excel avec plusieurs feuilles
-        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-            # Feuille principale : évolution des prix
-            df_analysis.to_excel(writer, sheet_name='Evolution_prix', index=False)
+        return self.output_dir / f"{menu_cod}_{menu_name}.xlsx"
 
-            # Feuille 2 : Statistiques par grille
-            stats_by_grille = df_analysis.groupby(['grille_cod', 'grille_libelle']).agg({
-                'cod_acte': 'count',
-                'prix_initial': 'mean',
-                'prix_actuel': 'mean',
-                'evolution_euros': 'mean',
-                'evolution_pct': 'mean'
-            }).round(2)
-            stats_by_grille.columns = ['Nb_actes', 'Prix_initial_moyen', 'Prix_actuel_moyen', 'Evolution_€_moyenne', 'Evolution_%_moyenne']
-            stats_by_grille.to_excel(writer, sheet_name='Stats_par_grille')
-
-            # Feuille 3 : Top évolutions
-            top_evolutions = df_analysis.nlargest(20, 'evolution_euros')[['cod_acte', 'nom_court', 'grille_cod', 'prix_initial', 'prix_actuel', 'evolution_euros', 'evolution_pct']]
-            top_evolutions.to_excel(writer, sheet_name='Top_evolutions', index=False)
+    def export_menu_to_excel(self, menu_cod, df_analysis):
+        """Exporte l'analyse d'un menu en Excel"""
+        if df_analysis is None or df_analysis.empty:
+            return
 
-        return filename
+        return write_menu_excel(self.get_menu_filename(menu_cod), df_analysis)
 
     def run_full_analysis(self):
         """Exécute l'analyse complète"""
@@ -309,11 +467,8 @@ class CCAMPriceEvolutionAnalyzer:
         # 1. Chargement
         self.load_all_tables()
 
-        # 2. Jointures
-        self.merge_tables()
-
-        # 3. Filtrage
-        self.apply_filters()
+        # 2-3. Jointures et filtrage (ou relecture du cache)
+        self.load_or_build_merged()
 
         # 4. Groupement par menu
         menus = self.group_by_menu()
@@ -323,19 +478,35 @@ class CCAMPriceEvolutionAnalyzer:
         print("GÉNÉRATION DES FICHIERS EXCEL PAR MENU")
         print("=" * 80)
 
-        total_menus = len(menus)
-        for i, menu_cod in enumerate(menus, 1):
-            print(f"\n[{i}/{total_menus}] Menu {menu_cod}...")
-
-            # Analyse
-            df_analysis = self.analyze_price_evolution_for_menu(menu_cod)
+        # Analyse de tous les menus en une passe, puis découpage par menu
+        df_evolution = self.analyze_price_evolution()
+        analyses = {}
+        if not df_evolution.empty:
+            for menu_cod, df_group in df_evolution.groupby('menu_cod', sort=False, observed=True):
+                analyses[menu_cod] = df_group.drop(columns='menu_cod').reset_index(drop=True)
 
-            if df_analysis is not None and not df_analysis.empty:
-                # Export
-                filename = self.export_menu_to_excel(menu_cod, df_analysis)
-                print(f"   ✓ {len(df_analysis)} actes analysés → {filename.name}")
-            else:
-                print(f"   ⚠ Aucune donnée pour ce menu")
+        # Les fichiers Excel sont indépendants : écriture dans un pool de processus,
+        # les résultats arrivent dans l'ordre des menus
+        exportable = [menu_cod for menu_cod in menus if menu_cod in analyses]
+        total_menus = len(menus)
+        with ProcessPoolExecutor() as executor:
+            filenames = executor.map(
+                write_menu_excel,
+                [self.get_menu_filename(menu_cod) for menu_cod in exportable],
+                [analyses[menu_cod] for menu_cod in exportable],
+                chunksize=8
+            )
+
+            for i, menu_cod in enumerate(menus, 1):
+                print(f"\n[{i}/{total_menus}] Menu {menu_cod}...")
+
+                df_analysis = analyses.get(menu_cod)
+
+                if df_analysis is not None:
+                    filename = next(filenames)
+                    print(f"   ✓ {len(df_analysis)} actes analysés → {filename.name}")
+                else:
+                    print(f"   ⚠ Aucune donnée pour ce menu")
 
         print("\n" + "=" * 80)
         print(f"✅ ANALYSE TERMINÉE - {total_menus} fichiers Excel générés dans : {self.output_dir}")
@@ -4,34 +4,43 @@ Script de pré-conversion des fichiers DBF en pickle
 pour accélérer les chargements futurs
 """
 
+import contextlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import pickle
-from extract_and_convert import convert_dbf_to_df
+from extract_and_convert import convert_dbf_to_df, is_pickle_fresh
 
 
-def convert_and_save(dbf_path: Path, output_dir: Path):
-    """Convertit un DBF en DataFrame et le sauvegarde en pickle"""
+def convert_and_save(dbf_path: Path, output_dir: Path) -> str:
+    """
+    Convertit un DBF en DataFrame et le sauvegarde en pickle
+
+    Exécutée dans un processus séparé : les affichages de la conversion
+    (encodage détecté...) sont capturés et retournés avec le message de
+    résultat, pour ne pas mélanger les sorties des tables.
+    """
     table_name = dbf_path.stem
     output_file = output_dir / f"{table_name}.pkl"
 
-    if output_file.exists():
-        print(f"   ⏭  {table_name} déjà converti")
-        return
-
-    print(f"   📊 Conversion de {table_name}...", end="", flush=True)
+    # Seul un pickle à jour et au format courant est conservé
+    if is_pickle_fresh(dbf_path, output_file):
+        return f"   ⏭  {table_name} déjà converti"
 
+    output = io.StringIO()
     try:
-        df = convert_dbf_to_df(dbf_path)
-
-        # Sauvegarder en pickle
-        with open(output_file, 'wb') as f:
-            pickle.dump(df, f)
+        # Le pickle est écrit par convert_dbf_to_df
+        with contextlib.redirect_stdout(output):
+            df = convert_dbf_to_df(dbf_path, cache_dir=output_dir)
 
         size_mb = output_file.stat().st_size / (1024 * 1024)
-        print(f" ✓ ({len(df):,} lignes, {size_mb:.1f} MB)")
+        result = f"📊 Conversion de {table_name}... ✓ ({len(df):,} lignes, {size_mb:.1f} MB)"
 
     except Exception as e:
-        print(f" ❌ Erreur: {e}")
+        result = f"📊 Conversion de {table_name}... ❌ Erreur: {e}"
+
+    lines = output.getvalue().splitlines() + [result]
+    return "\n".join(f"   {line}" for line in lines)
 
 
 def main():
@@ -60,15 +69,22 @@ def main():
     print(f"📁 Dossier destination: {output_dir}")
     print(f"\n🔄 Tables à convertir: {len(tables_needed)}\n")
 
-    for i, table_name in enumerate(tables_needed, 1):
-        dbf_file = data_path / f"{table_name}.dbf"
-
-        if not dbf_file.exists():
-            print(f"{i}. ❌ {table_name}.dbf introuvable")
-            continue
-
-        print(f"{i}. {table_name}")
-        convert_and_save(dbf_file, output_dir)
+    # Les tables sont indépendantes : une conversion par processus,
+    # résultats affichés dans l'ordre des tables
+    tables_found = [name for name in tables_needed if (data_path / f"{name}.dbf").exists()]
+    max_workers = max(1, min(len(tables_found), os.cpu_count() or 1))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            table_name: executor.submit(convert_and_save, data_path / f"{table_name}.dbf", output_dir)
+            for table_name in tables_found
+        }
+        for i, table_name in enumerate(tables_needed, 1):
+            if table_name not in futures:
+                print(f"{i}. ❌ {table_name}.dbf introuvable")
+                continue
+
+            print(f"{i}. {table_name}")
+            print(futures[table_name].result())
 
     print("\n" + "=" * 80)
     print("✅ CONVERSION TERMINÉE")
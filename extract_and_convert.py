@@ -4,15 +4,63 @@ Script d'extraction et de conversion des fichiers CCAM
 Extrait les fichiers ZIP et convertit les DBF en DataFrames pandas
 """
 
+import functools
+import os
+import struct
 import zipfile
 from pathlib import Path
 from dbfread import DBF
+from dbfread.codepages import codepages as dbf_codepages
+import numpy as np
 import pandas as pd
 from charset_normalizer import from_bytes
 
 
+# Dossier des DataFrames mis en cache (un .pkl par table DBF)
+PICKLE_DIR = Path(__file__).parent / "data" / "pickle"
+
+# Version du format des pickles de cache (stockée dans DataFrame.attrs) :
+# à incrémenter à chaque changement du lecteur pour invalider les anciens pickles
+CACHE_VERSION = 2
+
+
+# Identifiant de pilote de langue (octet 29 de l'en-tête DBF) ➜ page de code :
+# table de dbfread, complétée des pilotes FoxPro qu'elle ne connaît pas.
+# 0x00 (aucune page déclarée) est exclu pour passer par la détection statistique.
+DBF_CODEPAGES = {
+    language_driver: encoding
+    for language_driver, (encoding, _) in dbf_codepages.items()
+    if language_driver != 0x00
+}
+DBF_CODEPAGES.update({0x6C: 'cp863', 0x86: 'cp737', 0x87: 'cp852', 0x88: 'cp857', 0xCC: 'cp1257'})
+
+
 def detect_encoding(dbf_path: Path) -> str:
-    """Détecte l'encodage d'un fichier DBF"""
+    """
+    Détecte l'encodage d'un fichier DBF
+
+    Utilise la page de code déclarée dans l'en-tête ; la détection
+    statistique n'est utilisée que si l'octet est absent ou inconnu.
+    Le résultat est mis en cache par chemin absolu.
+    """
+    return _detect_encoding(str(Path(dbf_path).resolve()))
+
+
+@functools.lru_cache(maxsize=None)
+def _detect_encoding(dbf_path: str) -> str:
+    """Détecte l'encodage d'un fichier DBF (chemin absolu)"""
+    dbf_path = Path(dbf_path)
+    try:
+        with open(dbf_path, 'rb') as f:
+            f.seek(29)
+            language_driver = f.read(1)
+        if language_driver and language_driver[0] in DBF_CODEPAGES:
+            encoding = DBF_CODEPAGES[language_driver[0]]
+            print(f"🗂  {dbf_path.name} ➜ encodage déclaré : {encoding}")
+            return encoding
+    except OSError as e:
+        print(f"❌ Erreur lecture en-tête pour {dbf_path.name}: {e}")
+
     try:
         with open(dbf_path, 'rb') as f:
             raw_data = f.read(10000)  # Lit les 10 premiers ko
@@ -32,11 +80,137 @@ def detect_encoding(dbf_path: Path) -> str:
         return 'cp850'
 
 
-def convert_dbf_to_df(dbf_path: Path) -> pd.DataFrame:
-    """Convertit un fichier DBF en DataFrame pandas"""
+def convert_dbf_to_df(dbf_path: Path, cache_dir: Path = PICKLE_DIR, columns: list = None) -> pd.DataFrame:
+    """
+    Convertit un fichier DBF en DataFrame pandas
+
+    Le résultat est mis en cache dans `cache_dir/<table>.pkl` : si le pickle
+    est plus récent que le DBF et au format courant (CACHE_VERSION) il est
+    relu directement, sinon le DBF est parsé puis le pickle est (ré)écrit.
+    Le cache contient toujours la table complète ; `columns` ne garde que
+    les colonnes demandées en sortie. Avec `cache_dir=None`, seules les
+    colonnes demandées sont décodées.
+    """
+    if cache_dir is None:
+        return read_dbf(dbf_path, columns)
+
+    pkl_path = cache_dir / f"{dbf_path.stem}.pkl"
+
+    # Cache à jour : lecture directe du pickle
+    df = load_cached_pickle(dbf_path, pkl_path)
+    if df is None:
+        df = read_dbf(dbf_path)
+        save_pickle(df, pkl_path)
+
+    return df if columns is None else df[columns].copy()
+
+
+def read_dbf(dbf_path: Path, columns: list = None) -> pd.DataFrame:
+    """Lit un fichier DBF (lecture vectorisée, dbfread en secours)"""
     # Détecte l'encodage
     encoding = detect_encoding(dbf_path)
 
+    # Lecture vectorisée, dbfread en secours pour les formats non gérés
+    try:
+        return read_dbf_vectorized(dbf_path, encoding, columns)
+    except (ValueError, LookupError, struct.error) as e:
+        print(f"⚠  {dbf_path.name} ➜ lecture rapide impossible ({e}), utilisation de dbfread")
+        df = read_dbf_dbfread(dbf_path, encoding)
+        return df if columns is None else df[columns].copy()
+
+
+def read_dbf_fields(f) -> list:
+    """Lit les descripteurs de champs (nom, type, longueur, décimales) d'un DBF"""
+    fields = []
+    while True:
+        descriptor = f.read(32)
+        if not descriptor or descriptor[0] == 0x0D:
+            break
+        if len(descriptor) < 32:
+            raise ValueError("descripteur de champ tronqué")
+        name = descriptor[:11].split(b'\0', 1)[0].decode('ascii').lower()
+        field_type = chr(descriptor[11])
+        length, decimal_count = descriptor[16], descriptor[17]
+        fields.append((name, field_type, length, decimal_count))
+    return fields
+
+
+def decode_dbf_column(raw: np.ndarray, field_type: str, decimal_count: int, encoding: str):
+    """Convertit une colonne brute (tableau d'octets de largeur fixe) en une seule opération vectorisée"""
+    if field_type == 'C':
+        return np.char.decode(np.char.rstrip(raw, b' '), encoding).astype(object)
+
+    if field_type in ('N', 'F'):
+        stripped = np.char.strip(raw)
+        empty = stripped == b''
+        if decimal_count == 0 and not empty.any():
+            try:
+                return stripped.astype(np.int64)
+            except ValueError:
+                pass
+        return np.where(empty, b'nan', stripped).astype(np.float64)
+
+    if field_type == 'D':
+        return pd.to_datetime(np.char.decode(raw, 'ascii'), format='%Y%m%d', errors='coerce', cache=True)
+
+    if field_type == 'L':
+        values = np.full(len(raw), None, dtype=object)
+        values[np.isin(raw, [b'T', b't', b'Y', b'y'])] = True
+        values[np.isin(raw, [b'F', b'f', b'N', b'n'])] = False
+        return values
+
+    raise ValueError(f"type de champ '{field_type}' non géré")
+
+
+def read_dbf_vectorized(dbf_path: Path, encoding: str, columns: list = None) -> pd.DataFrame:
+    """
+    Lit un fichier DBF en un seul passage avec NumPy
+
+    Tous les enregistrements sont lus d'un bloc puis découpés par un dtype
+    structuré (une colonne par champ), chaque colonne étant convertie par
+    une opération vectorisée. Les champs mémo sont ignorés, ainsi que les
+    champs absents de `columns` s'il est fourni.
+    """
+    with open(dbf_path, 'rb') as f:
+        version, _, _, _, n_records, header_len, record_len = struct.unpack('<BBBBIHH20x', f.read(32))
+        if version & 0x07 == 4:
+            raise ValueError("format dBase 7 non géré")
+
+        fields = read_dbf_fields(f)
+
+        f.seek(header_len)
+        data = f.read(n_records * record_len)
+
+    # Dtype structuré : drapeau de suppression puis un champ d'octets par colonne
+    names, formats, offsets = ['_deleted'], ['S1'], [0]
+    offset = 1
+    for name, _, length, _ in fields:
+        names.append(name)
+        formats.append(f'S{length}')
+        offsets.append(offset)
+        offset += length
+    if offset > record_len:
+        raise ValueError("longueur d'enregistrement incohérente")
+    record_dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': record_len})
+
+    raw = np.frombuffer(data, dtype=record_dtype, count=len(data) // record_len)
+    raw = raw[raw['_deleted'] != b'*']
+
+    data_columns = {}
+    for name, field_type, _, decimal_count in fields:
+        if field_type == 'M' or (columns is not None and name not in columns):
+            continue
+        data_columns[name] = decode_dbf_column(raw[name], field_type, decimal_count, encoding)
+
+    # Colonnes dans l'ordre demandé (KeyError si une colonne n'existe pas)
+    if columns is not None:
+        data_columns = {name: data_columns[name] for name in columns}
+
+    return pd.DataFrame(data_columns)
+
+
+def read_dbf_dbfread(dbf_path: Path, encoding: str) -> pd.DataFrame:
+    """Lit un fichier DBF enregistrement par enregistrement avec dbfread"""
     # Lit le fichier DBF
     dbf = DBF(str(dbf_path), encoding=encoding)
 
@@ -52,9 +226,65 @@ def convert_dbf_to_df(dbf_path: Path) -> pd.DataFrame:
     else:
         df = pd.DataFrame(columns=column_names)
 
+    # Dates en datetime64 comme pour la lecture vectorisée
+    for field in dbf.fields:
+        if field.type == 'D':
+            df[field.name.lower()] = pd.to_datetime(df[field.name.lower()], errors='coerce')
+
+    return df
+
+
+def is_pickle_fresh(dbf_path: Path, pkl_path: Path) -> bool:
+    """
+    Indique si le pickle est à jour, sans le relire
+
+    Il doit être plus récent que le DBF et son fichier `.pkl.version`
+    doit porter la version courante du cache (CACHE_VERSION).
+    """
+    if not pkl_path.exists() or pkl_path.stat().st_mtime < dbf_path.stat().st_mtime:
+        return False
+
+    try:
+        return pkl_path.with_suffix('.pkl.version').read_text().strip() == str(CACHE_VERSION)
+    except OSError:
+        return False
+
+
+def load_cached_pickle(dbf_path: Path, pkl_path: Path):
+    """
+    Relit le pickle de cache d'un DBF s'il est utilisable, sinon retourne None
+
+    Le pickle est rejeté s'il est plus ancien que le DBF ou s'il a été écrit
+    par une autre version du lecteur (ancien convertisseur dbfread compris).
+    """
+    if not is_pickle_fresh(dbf_path, pkl_path):
+        return None
+
+    try:
+        df = pd.read_pickle(pkl_path)
+    except Exception as e:
+        print(f"⚠  {pkl_path.name} ➜ pickle illisible ({e}), reconversion")
+        return None
+
+    if not isinstance(df, pd.DataFrame) or df.attrs.get('cache_version') != CACHE_VERSION:
+        return None
+
     return df
 
 
+def save_pickle(df: pd.DataFrame, pkl_path: Path):
+    """Sauvegarde un DataFrame en pickle de façon atomique, marqué de la version du cache"""
+    df.attrs['cache_version'] = CACHE_VERSION
+    pkl_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = pkl_path.with_suffix('.pkl.tmp')
+    df.to_pickle(tmp_path, protocol=5)
+    os.replace(tmp_path, pkl_path)
+
+    # Version lisible sans désérialiser le pickle ; écrite après lui, un arrêt
+    # entre les deux laisse au pire une version périmée (donc une reconversion)
+    pkl_path.with_suffix('.pkl.version').write_text(f"{CACHE_VERSION}\n")
+
+
 def extract_zip_files(data_path: Path):
     """Extrait tous les fichiers ZIP du dossier"""
     print("\n📦 Extraction des fichiers ZIP...")